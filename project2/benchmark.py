@@ -0,0 +1,211 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance
+
+from 图片水印 import (
+    _build_payload,
+    detect_watermark_dct,
+    embed_watermark,
+    embed_watermark_dct,
+    embed_watermark_tiled,
+    extract_watermark,
+)
+
+# 与 测试结果 目录中的处理方式一致：翻转、平移、截取、调整对比度
+ATTACKS = ["none", "flip", "shift", "crop", "contrast"]
+
+def make_carrier(megapixels, seed=0):
+    # 合成载体：平滑渐变 + 噪声，PNG 压缩特性接近真实照片
+    side = int(np.sqrt(megapixels * 1e6 * 4 / 3))
+    width, height = side, int(megapixels * 1e6) // side
+    rng = np.random.default_rng(seed)
+    yy = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    xx = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    for c, (a, b) in enumerate([(0.7, 0.3), (0.2, 0.8), (0.5, 0.5)]):
+        noise = rng.integers(-12, 13, size=(height, width), dtype=np.int16)
+        img[..., c] = np.clip(a * xx + b * yy + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(img, "RGB")
+
+def make_logo(width=256, height=64):
+    # 合成文字水印：与常见的徽标/文字水印一样易于压缩
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((2, 2, width - 3, height - 3), outline="navy", width=3)
+    draw.text((16, height // 2 - 6), "CXCYSJ WATERMARK", fill="navy")
+    return img
+
+def _quiet(fn, *args, **kwargs):
+    # 屏蔽被测函数中的提示输出
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = _quiet(fn, *args, **kwargs)
+    return time.perf_counter() - start, result
+
+def _summary(samples):
+    return {"min": min(samples), "median": statistics.median(samples)}
+
+def bench_throughput(megapixels, watermark_path, workdir, repeat, compression, lsb_bits, with_dct):
+    carrier_path = os.path.join(workdir, f"carrier_{megapixels}mp.png")
+    make_carrier(megapixels).save(carrier_path)
+    out = os.path.join(workdir, "out.png")
+    ext = os.path.join(workdir, "ext.png")
+    payload = _build_payload(Image.open(watermark_path).convert("RGB"), compression, lsb_bits)
+
+    timings = {"embed": [], "embed_tiled": [], "extract": []}
+    embed_phases, extract_phases = [], []
+    if with_dct:
+        timings.update({"embed_dct": [], "detect_dct": []})
+    for _ in range(repeat):
+        # 各阶段耗时由被测函数自身的 timings 钩子给出
+        embed_phases.append({})
+        timings["embed"].append(_timed(embed_watermark, carrier_path, watermark_path, out,
+                                       compression=compression, lsb_bits=lsb_bits,
+                                       timings=embed_phases[-1])[0])
+        extract_phases.append({})
+        timings["extract"].append(_timed(extract_watermark, out, ext, timings=extract_phases[-1])[0])
+        timings["embed_tiled"].append(_timed(embed_watermark_tiled, carrier_path, watermark_path, out,
+                                             compression=compression, lsb_bits=lsb_bits)[0])
+        if with_dct:
+            timings["embed_dct"].append(_timed(embed_watermark_dct, carrier_path, watermark_path, out)[0])
+            timings["detect_dct"].append(_timed(detect_watermark_dct, out, watermark_path, search=False)[0])
+
+    width, height = Image.open(carrier_path).size
+    return {
+        "megapixels": megapixels,
+        "width": width,
+        "height": height,
+        "carrier_bytes": os.path.getsize(carrier_path),
+        "payload_channels": payload.size,
+        "seconds": {name: _summary(v) for name, v in timings.items()},
+        "embed_phases": {ph: _summary([p[ph] for p in embed_phases]) for ph in embed_phases[0]},
+        "extract_phases": {ph: _summary([p[ph] for p in extract_phases]) for ph in extract_phases[0]},
+        "embed_megapixels_per_second": megapixels / statistics.median(timings["embed"]),
+    }
+
+def apply_attack(img, attack):
+    width, height = img.size
+    if attack == "flip":
+        return img.transpose(Image.FLIP_LEFT_RIGHT)
+    if attack == "shift":
+        arr = np.asarray(img)
+        dy, dx = height // 50, width // 40
+        shifted = np.zeros_like(arr)
+        shifted[dy:, dx:] = arr[:height - dy, :width - dx]
+        return Image.fromarray(shifted, "RGB")
+    if attack == "crop":
+        return img.crop((width // 10, height // 10, width - width // 10, height - height // 10))
+    if attack == "contrast":
+        return ImageEnhance.Contrast(img).enhance(1.3)
+    return img
+
+def _lsb_ber(attacked, payload):
+    # 直接比较载荷所在通道的低位与嵌入值（不依赖头信息能否解析）
+    flat = np.asarray(attacked.convert("RGB"), dtype=np.uint8).reshape(-1)
+    expected = np.concatenate([payload.header, payload.body])
+    n = min(flat.size, expected.size)
+    got = flat[:n].copy()
+    h = min(n, payload.header.size)
+    got[:h] &= 1
+    got[h:] &= (1 << payload.lsb_bits) - 1
+    errors = np.unpackbits((got ^ expected[:n]).reshape(-1, 1), axis=1).sum()
+    total_bits = payload.header.size + payload.body.size * payload.lsb_bits
+    # 截取后缺失的通道按每位 0.5 的错误率计
+    missing = (expected.size - n) * payload.lsb_bits * 0.5
+    return float((errors + missing) / total_bits)
+
+def bench_robustness(megapixels, watermark_path, workdir, compression, lsb_bits):
+    carrier_path = os.path.join(workdir, "robust_carrier.png")
+    make_carrier(megapixels, seed=1).save(carrier_path)
+    lsb_path = os.path.join(workdir, "robust_lsb.png")
+    dct_path = os.path.join(workdir, "robust_dct.png")
+    attacked_path = os.path.join(workdir, "attacked.png")
+    payload = _build_payload(Image.open(watermark_path).convert("RGB"), compression, lsb_bits)
+    _quiet(embed_watermark, carrier_path, watermark_path, lsb_path, compression=compression, lsb_bits=lsb_bits)
+    _quiet(embed_watermark_dct, carrier_path, watermark_path, dct_path)
+
+    results = []
+    for attack in ATTACKS:
+        lsb_img = apply_attack(Image.open(lsb_path).convert("RGB"), attack)
+        lsb_img.save(attacked_path)
+        try:
+            _quiet(extract_watermark, attacked_path, os.path.join(workdir, "robust_ext.png"))
+            extracted = True
+        except ValueError:
+            extracted = False
+
+        apply_attack(Image.open(dct_path).convert("RGB"), attack).save(attacked_path)
+        det = detect_watermark_dct(attacked_path, watermark_path)
+        results.append({
+            "attack": attack,
+            "lsb": {"bit_error_rate": _lsb_ber(lsb_img, payload), "extract_ok": extracted},
+            "dct": {"bit_error_rate": max(0.0, 1.0 - det["bit_agreement"]), "z": det["z"], "detected": det["detected"]},
+        })
+    return {"megapixels": megapixels, "attacks": results}
+
+def _float_list(s):
+    return [float(x) for x in s.split(",") if x]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="图片水印吞吐量与鲁棒性基准测试")
+    ap.add_argument("--megapixels", type=_float_list, default=[1, 4, 16],
+                    help="合成载体的分辨率（百万像素），逗号分隔，例如 1,10,100")
+    ap.add_argument("--robust-megapixels", type=float, default=1, help="鲁棒性测试所用载体的分辨率")
+    ap.add_argument("--watermark", default=None, help="水印图片，默认使用合成文字水印")
+    ap.add_argument("--compression", default="zlib", choices=["none", "zlib", "lzma"])
+    ap.add_argument("--lsb-bits", type=int, default=1, choices=[1, 2, 3, 4])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--no-dct", action="store_true", help="吞吐量测试中不包含 DCT 模式")
+    ap.add_argument("--output", "-o", default="-", help="结果 JSON 文件路径，默认输出到标准输出")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        watermark_path = args.watermark
+        if watermark_path is None:
+            watermark_path = os.path.join(workdir, "logo.png")
+            make_logo().save(watermark_path)
+
+        throughput = []
+        for mp in args.megapixels:
+            res = bench_throughput(mp, watermark_path, workdir, args.repeat,
+                                   args.compression, args.lsb_bits, not args.no_dct)
+            print(f"{mp} MP: 嵌入 {res['seconds']['embed']['median']:.3f}s, "
+                  f"提取 {res['seconds']['extract']['median']:.3f}s", file=sys.stderr)
+            throughput.append(res)
+
+        robustness = bench_robustness(args.robust_megapixels, watermark_path, workdir,
+                                      args.compression, args.lsb_bits)
+
+    report = {
+        "benchmark": "watermark",
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": Image.__version__,
+        "platform": platform.platform(),
+        "compression": args.compression,
+        "lsb_bits": args.lsb_bits,
+        "throughput": throughput,
+        "robustness": robustness,
+    }
+    out = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(out)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(out + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import struct
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import 图片水印 as wm
+
+WIDTH = 10
+
+def _save(path, arr):
+    Image.fromarray(arr, "RGB").save(path)
+    return str(path)
+
+@pytest.fixture
+def mark(tmp_path):
+    arr = np.random.default_rng(0).integers(0, 256, (4, 4, 3), dtype=np.uint8)
+    return _save(tmp_path / "mark.png", arr)
+
+def _payload_rows(mark_path, **kwargs):
+    payload = wm._build_payload(Image.open(mark_path).convert("RGB"), **kwargs)
+    return -(-payload.size // (WIDTH * 3))
+
+def _check_tiled(tmp_path, mark_path, height, band_height, **kwargs):
+    arr = np.random.default_rng(height).integers(0, 256, (height, WIDTH, 3), dtype=np.uint8)
+    carrier = _save(tmp_path / "carrier.png", arr)
+    ref = str(tmp_path / "ref.png")
+    out = str(tmp_path / "out.png")
+    wm.embed_watermark(carrier, mark_path, ref, **kwargs)
+    wm.embed_watermark_tiled(carrier, mark_path, out, band_height=band_height, **kwargs)
+    got = Image.open(out)
+    got.load()  # 输出被截断时这里会抛出 OSError
+    assert np.array_equal(np.asarray(got), np.asarray(Image.open(ref)))
+
+@pytest.mark.parametrize("extra_rows", [0, 1, 2])
+def test_tiled_payload_fills_carrier(tmp_path, mark, extra_rows):
+    # 载荷恰好写到最后一行时，最后一个条带也必须被解码并写出
+    height = _payload_rows(mark, compression="none") + extra_rows
+    _check_tiled(tmp_path, mark, height, 256, compression="none")
+
+@pytest.mark.parametrize("delta", [-1, 0, 1])
+def test_tiled_band_height_boundary(tmp_path, mark, delta):
+    rows = _payload_rows(mark, compression="none")
+    _check_tiled(tmp_path, mark, rows + 3, rows + delta, compression="none")
+
+def test_tiled_failure_leaves_no_output(tmp_path, mark):
+    arr = np.zeros((2, WIDTH, 3), dtype=np.uint8)
+    carrier = _save(tmp_path / "small.png", arr)
+    out = tmp_path / "out.png"
+    with pytest.raises(ValueError):
+        wm.embed_watermark_tiled(carrier, mark, str(out))
+    assert not out.exists()
+
+def test_batch_reembeds_when_options_change(tmp_path, mark):
+    src = tmp_path / "src"
+    src.mkdir()
+    arr = np.random.default_rng(1).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    _save(src / "c.png", arr)
+    out = str(tmp_path / "out")
+    expected = np.asarray(Image.open(mark))
+
+    def run(**kwargs):
+        result = wm.batch_embed(str(src), mark, out, workers=1, **kwargs)
+        got = wm.extract_watermark(os.path.join(out, "c.png"), str(tmp_path / "ext.png"))
+        assert np.array_equal(np.asarray(got), expected)
+        return result
+
+    assert run()["done"] == 1
+    assert run()["skipped"] == 1
+    # 编码选项改变后，旧输出不再视为最新
+    assert run(lsb_bits=2)["done"] == 1
+    assert run(lsb_bits=2)["skipped"] == 1
+    # 分带嵌入的像素与整图嵌入相同，切换嵌入方式不会使输出过期
+    assert run(lsb_bits=2, tiled=True, band_height=7)["skipped"] == 1
+    assert run(lsb_bits=2, tiled=True, band_height=7, force=True)["done"] == 1
+    assert run(lsb_bits=2, compression="lzma")["done"] == 1
+    assert run(legacy=True)["done"] == 1
+
+@pytest.mark.parametrize("kwargs", [{"lsb_bits": 2}, {"compression": "lzma"}, {"compression": "zlib"}])
+def test_legacy_rejects_v2_options(mark, kwargs):
+    with pytest.raises(ValueError):
+        wm._build_payload(Image.open(mark).convert("RGB"), legacy=True, **kwargs)
+
+def test_unknown_compression_rejected(mark):
+    with pytest.raises(ValueError):
+        wm._build_payload(Image.open(mark).convert("RGB"), compression="gzip")
+
+@pytest.mark.parametrize("compression", [None, "none", "zlib", "lzma"])
+@pytest.mark.parametrize("lsb_bits", [1, 2, 3, 4])
+def test_round_trip(tmp_path, mark, compression, lsb_bits):
+    arr = np.random.default_rng(lsb_bits).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    carrier = _save(tmp_path / "carrier.png", arr)
+    out = str(tmp_path / "out.png")
+    wm.embed_watermark(carrier, mark, out, compression=compression, lsb_bits=lsb_bits)
+    got = wm.extract_watermark(out, str(tmp_path / "ext.png"))
+    assert np.array_equal(np.asarray(got), np.asarray(Image.open(mark)))
+
+def test_corrupted_payload_fails_crc(tmp_path, mark):
+    carrier = _save(tmp_path / "carrier.png", np.zeros((64, 64, 3), dtype=np.uint8))
+    out = str(tmp_path / "out.png")
+    wm.embed_watermark(carrier, mark, out, compression="none")
+    # 翻转头信息之后第一个载荷通道的最低位
+    flat = np.asarray(Image.open(out)).reshape(-1).copy()
+    flat[wm.HEADER_V2_BITS] ^= 1
+    _save(tmp_path / "out.png", flat.reshape(64, 64, 3))
+    with pytest.raises(ValueError, match="CRC"):
+        wm.extract_watermark(out, str(tmp_path / "ext.png"))
+    assert not (tmp_path / "ext.png").exists()
+
+def test_dct_extract_after_crop_uses_detected_shift(tmp_path):
+    rng = np.random.default_rng(2)
+    carrier = _save(tmp_path / "carrier.png", rng.integers(0, 256, (600, 800, 3), dtype=np.uint8))
+    mark_arr = np.zeros((32, 32), dtype=np.uint8)
+    mark_arr[8:24, 4:28] = 255
+    mark = str(tmp_path / "mark.png")
+    Image.fromarray(mark_arr, "L").save(mark)
+    marked = str(tmp_path / "marked.png")
+    wm.embed_watermark_dct(carrier, mark, marked)
+    ref = np.asarray(wm.extract_watermark_dct(marked, str(tmp_path / "ref.png")))
+
+    cropped = _save(tmp_path / "cropped.png", np.asarray(Image.open(marked))[77:, 131:].copy())
+    det = wm.detect_watermark_dct(cropped, mark)
+    assert det["detected"] and det["shift"] != (0, 0)
+    got = np.asarray(wm.extract_watermark_dct(cropped, str(tmp_path / "got.png"), flip=det["flip"],
+                                              offset=det["offset"], shift=det["shift"]))
+    assert (got == ref).mean() > 0.8
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_timings_hook_reports_phases(tmp_path, mark, legacy):
+    carrier = _save(tmp_path / "carrier.png", np.zeros((64, 64, 3), dtype=np.uint8))
+    out = str(tmp_path / "out.png")
+    embed_t, extract_t = {}, {}
+    wm.embed_watermark(carrier, mark, out, legacy=legacy, timings=embed_t)
+    got = wm.extract_watermark(out, str(tmp_path / "ext.png"), timings=extract_t)
+    assert np.array_equal(np.asarray(got), np.asarray(Image.open(mark)))
+    assert set(embed_t) == {"decode", "bit_packing", "embedding", "png_encode"}
+    assert set(extract_t) == {"decode", "bit_unpacking", "png_encode"}
+
+def test_extract_unmarked_image_fails(tmp_path):
+    arr = np.random.default_rng(3).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    image = _save(tmp_path / "plain.png", arr)
+    with pytest.raises(ValueError):
+        wm.extract_watermark(image, str(tmp_path / "ext.png"))
+    assert not (tmp_path / "ext.png").exists()
+
+@pytest.mark.parametrize("header", [
+    struct.pack(wm.HEADER_FORMAT, 100, 100),
+    struct.pack(wm.HEADER_V2_FORMAT, wm.HEADER_V2_MAGIC, 0, 1, 4, 4, 100000, 0),
+])
+def test_extract_header_exceeding_capacity_fails(tmp_path, header):
+    # 旧实现会用黑色补足缺少的数据；现在必须直接报错
+    arr = np.random.default_rng(4).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    flat = arr.reshape(-1)
+    bits = wm._pack_values(header, 1)
+    flat[:bits.size] = (flat[:bits.size] & 0xFE) | bits
+    image = _save(tmp_path / "forged.png", arr)
+    with pytest.raises(ValueError, match="容量"):
+        wm.extract_watermark(image, str(tmp_path / "ext.png"))
+    assert not (tmp_path / "ext.png").exists()
@@ -1,201 +1,785 @@
 from PIL import Image
+import numpy as np
+import argparse
+import contextlib
+import hashlib
+import io
+import lzma
 import os
 import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 
-def embed_watermark(carrier_path, watermark_path, output_path):
+# 第1版头信息：宽度和高度各4字节（大端），水印为原始 RGB 字节，每个通道嵌入1位
+HEADER_FORMAT = ">II"
+HEADER_BITS = struct.calcsize(HEADER_FORMAT) * 8
 
-    # 打开载体图片和水印图片
-    carrier_img = Image.open(carrier_path).convert("RGB")
-    watermark_img = Image.open(watermark_path).convert("RGB")
-    
-    # 检查载体图片是否足够大
-    carrier_width, carrier_height = carrier_img.size
+# 第2版头信息：魔数+版本、压缩方式、每通道位数、宽、高、载荷字节数、CRC32（大端）。
+# CRC32 覆盖头信息中 CRC 之前的字段以及载荷数据。
+# 头信息固定按每通道1位嵌入，之后的载荷按每通道 lsb_bits 位嵌入。
+# 魔数按第1版解析时宽度约为14亿，不可能通过容量检查，因此两种格式可以区分。
+HEADER_V2_MAGIC = b"WMK\x02"
+HEADER_V2_FORMAT = ">4sBBIIII"
+HEADER_V2_BITS = struct.calcsize(HEADER_V2_FORMAT) * 8
+COMPRESSION_METHODS = {"none": 0, "zlib": 1, "lzma": 2}
+
+def _compress(data, method):
+    if method == 1:
+        return zlib.compress(data, 9)
+    if method == 2:
+        return lzma.compress(data)
+    return data
+
+def _decompress(data, method, limit):
+    # 最多解压 limit 字节，防止被篡改的数据解压出超大结果
+    if method == 1:
+        return zlib.decompressobj().decompress(data, limit)
+    if method == 2:
+        return lzma.LZMADecompressor().decompress(data, limit)
+    return data
+
+def _pack_values(data, lsb_bits):
+    # 字节流按高位在前展开为比特，每 lsb_bits 位组成一个通道值
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    if lsb_bits == 1:
+        return bits
+    pad = -bits.size % lsb_bits
+    if pad:
+        bits = np.concatenate([bits, np.zeros(pad, dtype=np.uint8)])
+    groups = bits.reshape(-1, lsb_bits)
+    values = groups[:, 0].copy()
+    for i in range(1, lsb_bits):
+        values <<= 1
+        values |= groups[:, i]
+    return values
+
+def _unpack_values(values, lsb_bits, nbytes):
+    bits = np.unpackbits(values.reshape(-1, 1), axis=1)[:, 8 - lsb_bits:]
+    return np.packbits(bits.reshape(-1)[:nbytes * 8]).tobytes()
+
+class _Payload:
+    # 待嵌入的通道值：header 部分每通道1位，body 部分每通道 lsb_bits 位
+
+    def __init__(self, header, body, lsb_bits):
+        self.header = header
+        self.body = body
+        self.lsb_bits = lsb_bits
+        self.size = header.size + body.size  # 占用的通道数
+
+    def embed(self, flat, pos=0):
+        # 把载荷中第 pos 个通道开始、长度为 flat.size 的部分写入 flat
+        end = pos + flat.size
+        regions = ((0, self.header, 1), (self.header.size, self.body, (1 << self.lsb_bits) - 1))
+        for start, values, mask in regions:
+            lo = max(pos, start)
+            hi = min(end, start + values.size)
+            if lo < hi:
+                seg = flat[lo - pos:hi - pos]
+                np.bitwise_and(seg, 0xFF ^ mask, out=seg)
+                np.bitwise_or(seg, values[lo - start:hi - start], out=seg)
+
+def _build_payload(watermark_img, compression=None, lsb_bits=1, legacy=False):
+    # compression 为 None 时：第2版默认 zlib，旧格式不压缩
     watermark_width, watermark_height = watermark_img.size
-    carrier_capacity = carrier_width * carrier_height * 3  # 每个像素3位
-    watermark_size = watermark_width * watermark_height * 3 * 8  # 每个像素3字节×8位
-    
-    # 需要额外存储头信息（宽度4字节，高度4字节）
-    header_size = 8 * 8  # 8字节×8位/字节
-    
-    if watermark_size + header_size > carrier_capacity:
-        raise ValueError(f"载体图片太小，无法容纳水印图片。需要: {watermark_size + header_size} 位, 可用: {carrier_capacity} 位")
-    
-    # 将水印图片转换为二进制字符串
-    watermark_bin = ""
-    for pixel in watermark_img.getdata():
-        for value in pixel:
-            watermark_bin += bin(value)[2:].zfill(8)
-    
-    # 创建头信息（宽度和高度各4字节）
-    header_bin = bin(watermark_width)[2:].zfill(32) + bin(watermark_height)[2:].zfill(32)
-    
-    # 合并头信息和水印数据
-    full_data = header_bin + watermark_bin
-    total_bits = len(full_data)
+    pixels = np.asarray(watermark_img, dtype=np.uint8).tobytes()
+    if compression is not None and compression not in COMPRESSION_METHODS:
+        raise ValueError(f"不支持的压缩方式: {compression}，可选: {', '.join(sorted(COMPRESSION_METHODS))}")
+    if legacy:
+        # 旧格式不压缩且每通道只写 1 位
+        if lsb_bits != 1 or compression not in (None, "none"):
+            raise ValueError("旧格式（legacy）不支持压缩或多位嵌入")
+        header = struct.pack(HEADER_FORMAT, watermark_width, watermark_height)
+        return _Payload(_pack_values(header, 1), _pack_values(pixels, 1), 1)
+    if not 1 <= lsb_bits <= 4:
+        raise ValueError("每通道嵌入位数必须在 1~4 之间")
+    method = COMPRESSION_METHODS[compression or "zlib"]
+    data = _compress(pixels, method)
+    fields = struct.pack(HEADER_V2_FORMAT[:-1], HEADER_V2_MAGIC, method, lsb_bits,
+                         watermark_width, watermark_height, len(data))
+    header = fields + struct.pack(">I", zlib.crc32(data, zlib.crc32(fields)) & 0xFFFFFFFF)
+    return _Payload(_pack_values(header, 1), _pack_values(data, lsb_bits), lsb_bits)
+
+@contextlib.contextmanager
+def _phase(timings, name):
+    # timings 为 None 时不计时；否则把该阶段耗时（秒）累加到 timings[name]
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+def _check_capacity(carrier_width, carrier_height, payload_channels):
+    carrier_capacity = carrier_width * carrier_height * 3  # 每个像素3个通道
+    if payload_channels > carrier_capacity:
+        raise ValueError(f"载体图片太小，无法容纳水印图片。需要: {payload_channels} 个通道, 可用: {carrier_capacity} 个通道")
+
+def _embed_payload(carrier_path, payload, output_path, timings=None):
+    # payload 为已编码的头信息+水印数据，可在多张载体间复用
+    with _phase(timings, "decode"):
+        carrier_img = Image.open(carrier_path).convert("RGB")
+        _check_capacity(*carrier_img.size, payload.size)
+        carrier_data = np.array(carrier_img, dtype=np.uint8)
     
-    # 将水印数据嵌入载体图片
-    carrier_data = list(carrier_img.getdata())
-    new_data = []
-    data_index = 0
+    # 将水印数据嵌入载体图片（R、G、B 通道依次写入）
+    with _phase(timings, "embedding"):
+        payload.embed(carrier_data.reshape(-1))
     
-    for pixel in carrier_data:
-        if data_index >= total_bits:
-            new_data.append(pixel)
-            continue
-            
-        r, g, b = pixel
-        # 嵌入R通道
-        r = (r & 0xFE) | int(full_data[data_index])
-        data_index += 1
-        
-        # 如果还有数据，嵌入G通道
-        if data_index < total_bits:
-            g = (g & 0xFE) | int(full_data[data_index])
-            data_index += 1
-        else:
-            new_data.append((r, g, b))
-            continue
-            
-        # 如果还有数据，嵌入B通道
-        if data_index < total_bits:
-            b = (b & 0xFE) | int(full_data[data_index])
-            data_index += 1
-            
-        new_data.append((r, g, b))
-    
-    # 保存含水印的图片
-    watermarked_img = Image.new("RGB", carrier_img.size)
-    watermarked_img.putdata(new_data)
+    # 保存含水印的图片（PNG格式，无损）
+    with _phase(timings, "png_encode"):
+        watermarked_img = Image.fromarray(carrier_data, "RGB")
+        watermarked_img.save(output_path, format="PNG")
+    return watermarked_img
+
+def embed_watermark(carrier_path, watermark_path, output_path, compression=None, lsb_bits=1, legacy=False,
+                    timings=None):
+
+    # timings 传入字典时，按阶段（decode、bit_packing、embedding、png_encode）累加耗时
+    # 打开水印图片，并编码头信息和水印数据
+    with _phase(timings, "decode"):
+        watermark_img = Image.open(watermark_path).convert("RGB")
+    with _phase(timings, "bit_packing"):
+        payload = _build_payload(watermark_img, compression, lsb_bits, legacy)
     
     # 确保使用PNG格式保存（无损）
     if not output_path.lower().endswith('.png'):
         output_path += '.png'
     
-    watermarked_img.save(output_path)
+    watermarked_img = _embed_payload(carrier_path, payload, output_path, timings)
     print(f"水印嵌入成功! 输出文件: {output_path}")
     return watermarked_img
 
-def extract_watermark(watermarked_path, output_path):
+# ---------------- 分带（流式）模式：用于超大载体图片 ----------------
+# 直接按行解码/编码 PNG 数据流，峰值内存只与条带高度有关，与图片大小无关。
+# 仅支持非隔行扫描、位深为8的 PNG；其它格式回退到 embed_watermark。
 
-    # 打开含水印图片
-    watermarked_img = Image.open(watermarked_path).convert("RGB")
-    pixel_data = list(watermarked_img.getdata())
-    
-    # 提取头信息（宽度和高度各4字节 = 32位）
-    header_bin = ""
-    bits_extracted = 0
-    header_bits_needed = 64  # 32位宽度 + 32位高度
-    
-    for pixel in pixel_data:
-        r, g, b = pixel
-        
-        # 提取R通道的LSB
-        header_bin += str(r & 1)
-        bits_extracted += 1
-        if bits_extracted >= header_bits_needed:
-            break
-            
-        # 提取G通道的LSB
-        header_bin += str(g & 1)
-        bits_extracted += 1
-        if bits_extracted >= header_bits_needed:
-            break
-            
-        # 提取B通道的LSB
-        header_bin += str(b & 1)
-        bits_extracted += 1
-        if bits_extracted >= header_bits_needed:
-            break
-    
-    if len(header_bin) < header_bits_needed:
-        raise ValueError("无法提取完整的头信息")
-    
-    # 解析宽度和高度
-    width_bin = header_bin[:32]
-    height_bin = header_bin[32:64]
-    
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 颜色类型 -> 每像素字节数（0灰度 2RGB 3调色板 4灰度+alpha 6RGBA）
+_PNG_BPP = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+class _PngRowReader:
+
+    def __init__(self, path):
+        self._f = open(path, "rb")
+        if self._f.read(8) != PNG_SIGNATURE:
+            self._f.close()
+            raise ValueError("不是 PNG 文件")
+        self.palette = None
+        self._first_idat = None
+        while self._first_idat is None:
+            ctype, data = self._read_chunk()
+            if ctype == b"IHDR":
+                (self.width, self.height, self.bit_depth, self.color_type,
+                 _, _, self.interlace) = struct.unpack(">IIBBBBB", data)
+            elif ctype == b"PLTE":
+                self.palette = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+            elif ctype == b"IDAT":
+                self._first_idat = data
+            elif ctype == b"IEND":
+                self._f.close()
+                raise ValueError("PNG 文件中没有图像数据")
+        self.bpp = _PNG_BPP.get(self.color_type)
+        self.stride = self.width * (self.bpp or 0)
+
+    def supported(self):
+        return self.bit_depth == 8 and self.interlace == 0 and self.bpp is not None \
+            and (self.color_type != 3 or self.palette is not None)
+
+    def _read_chunk(self):
+        head = self._f.read(8)
+        if len(head) < 8:
+            raise ValueError("PNG 文件不完整")
+        length, ctype = struct.unpack(">I4s", head)
+        data = self._f.read(length)
+        self._f.read(4)  # CRC
+        return ctype, data
+
+    def _idat_stream(self):
+        data = self._first_idat
+        while True:
+            yield data
+            ctype, data = self._read_chunk()
+            if ctype != b"IDAT":
+                return
+
+    def scanlines(self):
+        # 逐行产出滤波后的行数据（首字节为滤波类型），解压输出限制在若干行以内
+        line_len = self.stride + 1
+        d = zlib.decompressobj()
+        buf = bytearray()
+        rows = 0
+        for data in self._idat_stream():
+            while data:
+                buf += d.decompress(data, line_len * 16)
+                data = d.unconsumed_tail
+                while len(buf) >= line_len and rows < self.height:
+                    yield bytes(buf[:line_len])
+                    del buf[:line_len]
+                    rows += 1
+        buf += d.flush()
+        while len(buf) >= line_len and rows < self.height:
+            yield bytes(buf[:line_len])
+            del buf[:line_len]
+            rows += 1
+        if rows < self.height:
+            raise ValueError("PNG 图像数据不完整")
+
+    def decode(self, prev, lines):
+        # 把上一行原始数据（滤波类型0）与本条带的行拼成一个小 PNG，交给 PIL 解码，
+        # 这样 Average/Paeth 等滤波的还原仍在 C 代码中完成
+        head = struct.pack(">IIBBBBB", self.width, len(lines) + 1, 8, self.color_type, 0, 0, 0)
+        body = zlib.compress(b"\x00" + prev + b"".join(lines), 1)
+        png = bytearray(PNG_SIGNATURE)
+        chunks = [(b"IHDR", head)]
+        if self.palette is not None:
+            chunks.append((b"PLTE", self.palette.tobytes()))
+        chunks += [(b"IDAT", body), (b"IEND", b"")]
+        for ctype, data in chunks:
+            png += struct.pack(">I", len(data)) + ctype + data
+            png += struct.pack(">I", zlib.crc32(data, zlib.crc32(ctype)) & 0xFFFFFFFF)
+        img = Image.open(io.BytesIO(bytes(png)))
+        raw = np.asarray(img)
+        rgb = np.array(img.convert("RGB"))
+        # 返回本条带最后一行的原始字节（供下一条带使用）以及 RGB 数据
+        return raw[-1].tobytes(), rgb[1:].reshape(len(lines), -1)
+
+    def close(self):
+        self._f.close()
+
+class _PngRowWriter:
+
+    def __init__(self, path, width, height, idat_size=1 << 16):
+        self._path = path
+        self._height = height
+        self._rows = 0
+        self._f = open(path, "wb")
+        self._z = zlib.compressobj()
+        self._pending = bytearray()
+        self._idat_size = idat_size
+        self._f.write(PNG_SIGNATURE)
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _write_chunk(self, ctype, data):
+        self._f.write(struct.pack(">I", len(data)))
+        self._f.write(ctype)
+        self._f.write(data)
+        self._f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(ctype)) & 0xFFFFFFFF))
+
+    def _feed(self, data):
+        self._pending += self._z.compress(data)
+        if len(self._pending) >= self._idat_size:
+            self._write_chunk(b"IDAT", bytes(self._pending))
+            self._pending.clear()
+
+    def write_filtered(self, line):
+        self._feed(line)
+        self._rows += 1
+
+    def write_rows(self, rows):
+        # rows: (行数, 宽度×3) 的 RGB 数据，使用 Sub 滤波
+        px = rows.reshape(rows.shape[0], -1, 3)
+        filtered = px.copy()
+        filtered[:, 1:] -= px[:, :-1]
+        for row in filtered.reshape(rows.shape[0], -1):
+            self._feed(b"\x01")
+            self._feed(row.tobytes())
+        self._rows += rows.shape[0]
+
+    def close(self):
+        if self._rows != self._height:
+            self.abort()
+            raise ValueError(f"写入行数 {self._rows} 与图片高度 {self._height} 不符")
+        self._pending += self._z.flush()
+        if self._pending:
+            self._write_chunk(b"IDAT", bytes(self._pending))
+        self._write_chunk(b"IEND", b"")
+        self._f.close()
+
+    def abort(self):
+        # 出错时不写 IEND，直接删除不完整的输出文件
+        self._f.close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+class _RgbRowSource:
+    # 按行读取图片的 RGB 数据：PNG 走流式解码，只解压到需要的行为止；
+    # 其它格式由 PIL 打开后按行裁剪
+
+    def __init__(self, path):
+        try:
+            self._png = _PngRowReader(path)
+        except ValueError:
+            self._png = None
+        if self._png is not None and not self._png.supported():
+            self._png.close()
+            self._png = None
+        if self._png is not None:
+            self.size = (self._png.width, self._png.height)
+            self._lines = self._png.scanlines()
+            self._prev = bytes(self._png.stride)
+        else:
+            self._img = Image.open(path)
+            self.size = self._img.size
+            self._y = 0
+
+    def read(self, rows):
+        # 读取接下来的 rows 行，返回 (rows, 宽度×3) 的 uint8 数组
+        if self._png is not None:
+            lines = [next(self._lines) for _ in range(rows)]
+            self._prev, band = self._png.decode(self._prev, lines)
+            return band
+        box = (0, self._y, self.size[0], self._y + rows)
+        self._y += rows
+        return np.asarray(self._img.crop(box).convert("RGB"), dtype=np.uint8).reshape(rows, -1)
+
+    def close(self):
+        if self._png is not None:
+            self._png.close()
+        else:
+            self._img.close()
+
+def extract_watermark(watermarked_path, output_path, timings=None):
+
+    # timings 传入字典时，按阶段（decode、bit_unpacking、png_encode）累加耗时
+    # 打开含水印图片（只读取尺寸，不解码像素）
+    with _phase(timings, "decode"):
+        source = _RgbRowSource(watermarked_path)
     try:
-        width = int(width_bin, 2)
-        height = int(height_bin, 2)
-    except:
-        raise ValueError("无法解析水印尺寸信息")
-    
-    print(f"提取的水印尺寸: {width}×{height} 像素")
-    
-    # 计算水印数据总位数
-    watermark_bits_needed = width * height * 3 * 8
-    
-    # 提取水印数据（跳过已读取的头信息）
-    watermark_bin = ""
-    current_index = bits_extracted // 3  # 已经处理的像素数
-    if bits_extracted % 3 != 0:
-        current_index += 1
-    
-    bits_extracted = 0
-    
-    # 继续提取剩余像素
-    for i in range(current_index, len(pixel_data)):
-        if bits_extracted >= watermark_bits_needed:
-            break
-            
-        r, g, b = pixel_data[i]
+        image_width, image_height = source.size
+        row_values = image_width * 3
+        capacity = row_values * image_height
+        if capacity < HEADER_BITS:
+            raise ValueError("无法提取完整的头信息")
         
-        # 提取R通道
-        watermark_bin += str(r & 1)
-        bits_extracted += 1
-        if bits_extracted >= watermark_bits_needed:
-            break
-            
-        # 提取G通道
-        watermark_bin += str(g & 1)
-        bits_extracted += 1
-        if bits_extracted >= watermark_bits_needed:
-            break
-            
-        # 提取B通道
-        watermark_bin += str(b & 1)
-        bits_extracted += 1
-        if bits_extracted >= watermark_bits_needed:
-            break
-    
-    # 将二进制数据转换为像素值
-    watermark_data = []
-    for i in range(0, min(len(watermark_bin), watermark_bits_needed), 8):
-        if i + 8 > len(watermark_bin):
-            break
-        byte = watermark_bin[i:i+8]
-        watermark_data.append(int(byte, 2))
-    
-    # 确保数据长度匹配图像尺寸
-    expected_pixels = width * height
-    expected_values = expected_pixels * 3
-    if len(watermark_data) < expected_values:
-        # 填充缺失数据为黑色
-        watermark_data.extend([0] * (expected_values - len(watermark_data)))
-    
-    # 创建水印图片
-    watermark_img = Image.new("RGB", (width, height))
-    
-    # 将数据组织为RGB元组
-    pixels = []
-    for i in range(0, len(watermark_data), 3):
-        r = watermark_data[i] if i < len(watermark_data) else 0
-        g = watermark_data[i+1] if i+1 < len(watermark_data) else 0
-        b = watermark_data[i+2] if i+2 < len(watermark_data) else 0
-        pixels.append((r, g, b))
+        # 按需解码前若干行，保证至少包含 n 个通道值
+        with _phase(timings, "decode"):
+            rows = [source.read(-(-HEADER_BITS // row_values)).reshape(-1)]
+        decoded = rows[0].size
+        def channels(n):
+            nonlocal decoded
+            if n > decoded:
+                with _phase(timings, "decode"):
+                    rows.append(source.read(-(-(n - decoded) // row_values)).reshape(-1))
+                    decoded += rows[-1].size
+                    rows[:] = [np.concatenate(rows)]
+            return rows[0]
+        
+        # 先读取第1版头信息长度（64位）的数据，根据魔数判断格式版本
+        header = np.packbits(channels(HEADER_BITS)[:HEADER_BITS] & 1).tobytes()
+        if header[:4] == HEADER_V2_MAGIC and capacity >= HEADER_V2_BITS:
+            header = np.packbits(channels(HEADER_V2_BITS)[:HEADER_V2_BITS] & 1).tobytes()
+            _, method, lsb_bits, width, height, length, crc = struct.unpack(HEADER_V2_FORMAT, header)
+            start = HEADER_V2_BITS
+            body_channels = -(-length * 8 // lsb_bits) if 1 <= lsb_bits <= 4 else 0
+            if (method not in COMPRESSION_METHODS.values() or body_channels == 0
+                    or width == 0 or height == 0 or start + body_channels > capacity):
+                raise ValueError("水印头信息无效或与图片容量不符，图片中可能不含水印")
+        else:
+            width, height = struct.unpack(HEADER_FORMAT, header)
+            method, lsb_bits, crc = 0, 1, None
+            start = HEADER_BITS
+            length = width * height * 3
+            body_channels = length * 8
+            # 头信息与图片容量不符时直接报错
+            if width == 0 or height == 0 or start + body_channels > capacity:
+                raise ValueError(f"水印尺寸信息 {width}×{height} 与图片容量不符，图片中可能不含水印")
+        
+        print(f"提取的水印尺寸: {width}×{height} 像素")
+        
+        # 只解码载荷实际占用的行
+        pixel_data = channels(start + body_channels)
+    finally:
+        source.close()
     
-    watermark_img.putdata(pixels[:expected_pixels])
+    # 提取水印数据（紧接在头信息之后）
+    with _phase(timings, "bit_unpacking"):
+        mask = (1 << lsb_bits) - 1
+        data = _unpack_values(pixel_data[start:start + body_channels] & mask, lsb_bits, length)
+        if crc is not None and zlib.crc32(data, zlib.crc32(header[:-4])) & 0xFFFFFFFF != crc:
+            raise ValueError("水印数据校验失败（CRC 不匹配），图片可能已被修改")
+        try:
+            data = _decompress(data, method, width * height * 3 + 1)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise ValueError(f"水印数据解压失败: {e}")
+        if len(data) != width * height * 3:
+            raise ValueError("水印数据长度与尺寸信息不符")
+        watermark_data = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
     
     # 确保使用PNG格式保存
     if not output_path.lower().endswith('.png'):
         output_path += '.png'
     
-    watermark_img.save(output_path)
+    # 创建并保存水印图片
+    with _phase(timings, "png_encode"):
+        watermark_img = Image.fromarray(watermark_data, "RGB")
+        watermark_img.save(output_path)
     print(f"水印提取成功! 输出文件: {output_path}")
     return watermark_img
 
+def _embed_payload_tiled(carrier_path, payload, output_path, band_height=256):
+
+    try:
+        reader = _PngRowReader(carrier_path)
+    except ValueError:
+        reader = None
+    if reader is None or not reader.supported():
+        if reader is not None:
+            reader.close()
+        _embed_payload(carrier_path, payload, output_path)
+        return output_path
+
+    carrier_width, carrier_height = reader.width, reader.height
+    try:
+        _check_capacity(carrier_width, carrier_height, payload.size)
+    except ValueError:
+        reader.close()
+        raise
+    payload_rows = -(-payload.size // (carrier_width * 3))  # 载荷实际覆盖的行数
+
+    # RGB 载体在载荷之后的行可以原样复制滤波数据，无需解码；
+    # 紧接载荷的那一行引用了被修改的上一行，需要解码后重新滤波
+    passthrough = reader.color_type == 2
+    last_decoded = min(payload_rows, carrier_height - 1) if passthrough else carrier_height - 1
+
+    writer = _PngRowWriter(output_path, carrier_width, carrier_height)
+    try:
+        prev = bytes(reader.stride)
+        lines = []
+        pos = 0
+        for y, line in enumerate(reader.scanlines()):
+            if y > last_decoded:
+                writer.write_filtered(line)
+                continue
+            lines.append(line)
+            if len(lines) < band_height and y < last_decoded:
+                continue
+            prev, band = reader.decode(prev, lines)
+            lines = []
+            if pos < payload.size:
+                payload.embed(band.reshape(-1), pos)
+                pos += band.size
+            writer.write_rows(band)
+    except BaseException:
+        writer.abort()
+        raise
+    else:
+        writer.close()
+    finally:
+        reader.close()
+
+    return output_path
+
+def embed_watermark_tiled(carrier_path, watermark_path, output_path, band_height=256,
+                          compression=None, lsb_bits=1, legacy=False):
+
+    if not output_path.lower().endswith('.png'):
+        output_path += '.png'
+
+    payload = _build_payload(Image.open(watermark_path).convert("RGB"), compression, lsb_bits, legacy)
+    _embed_payload_tiled(carrier_path, payload, output_path, band_height)
+    print(f"水印嵌入成功! 输出文件: {output_path}")
+    return output_path
+
+# ---------------- 8×8 分块 DCT 鲁棒水印 ----------------
+# LSB 水印无法经受翻转、平移、截取、调整对比度等处理。DCT 模式把水印图片缩放并二值化为
+# mark_size×mark_size 的比特块，按块坐标对 mark_size 取模周期性地铺满整幅图片：每个 8×8
+# 亮度块携带一位，在中频系数上叠加 ±strength×密钥伪随机图样（扩频）。
+# 提取时对同一比特的所有块做相关求和并取符号；检测器计算与原水印的归一化相关，
+# 并在翻转方向、分块网格偏移和比特块循环平移上搜索最大值，因此能应对上述处理。
+# 全部计算以 (块行, 块列, 8, 8) 张量的批量矩阵乘完成，不逐块循环。
+
+DCT_BLOCK = 8
+# 选用 u+v 为 4、5 的中频系数：既不明显影响画质，又不易被压缩、对比度调整破坏
+_DCT_BAND = [(u, s - u) for s in (4, 5) for u in range(s + 1) if u < DCT_BLOCK and s - u < DCT_BLOCK]
+_DCT_ROWS = np.array([u for u, _ in _DCT_BAND])
+_DCT_COLS = np.array([v for _, v in _DCT_BAND])
+
+def _dct_matrix(n=DCT_BLOCK):
+    k = np.arange(n)
+    c = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    c[0] /= np.sqrt(2.0)
+    return c.astype(np.float32)
+
+_DCT = _dct_matrix()
+
+def _dct_key(key, mark_size):
+    # 由密钥生成：中频系数上的 ±1 扩频图样（对所有块相同，因此截取后仍可对齐），
+    # 以及比特块上的 ±1 掩码（使不同密钥的水印互不相关）
+    rng = np.random.default_rng(key)
+    signs = np.array([-1.0, 1.0], dtype=np.float32)
+    pattern = rng.choice(signs, size=len(_DCT_BAND))
+    mask = rng.choice(signs, size=(mark_size, mark_size))
+    return pattern, mask
+
+def _luma(rgb):
+    return rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114
+
+def _blocks(y):
+    # (H, W) -> (块行, 块列, 8, 8)，丢弃不足一块的边缘
+    h, w = y.shape[0] // DCT_BLOCK, y.shape[1] // DCT_BLOCK
+    return y[:h * DCT_BLOCK, :w * DCT_BLOCK].reshape(h, DCT_BLOCK, w, DCT_BLOCK).swapaxes(1, 2)
+
+def _unblocks(b):
+    h, w = b.shape[:2]
+    return b.swapaxes(1, 2).reshape(h * DCT_BLOCK, w * DCT_BLOCK)
+
+def _mark_bits(watermark_path, mark_size):
+    # 水印图片缩放为 mark_size×mark_size 灰度图并按均值二值化，返回 ±1 矩阵
+    mark = np.asarray(Image.open(watermark_path).convert("L").resize((mark_size, mark_size)), dtype=np.float32)
+    return np.where(mark > mark.mean(), 1.0, -1.0).astype(np.float32)
+
+def _block_bit_index(h, w, mark_size):
+    return (np.arange(h)[:, None] % mark_size) * mark_size + (np.arange(w)[None, :] % mark_size)
+
+def _dct_soft_bits(rgb, pattern, mark_size):
+    # 每个比特块位置的相关和（未去掩码、未取符号），形状 (mark_size, mark_size)
+    coeffs = _DCT @ _blocks(_luma(rgb.astype(np.float32))) @ _DCT.T
+    corr = coeffs[:, :, _DCT_ROWS, _DCT_COLS] @ pattern
+    idx = _block_bit_index(*corr.shape, mark_size)
+    soft = np.bincount(idx.reshape(-1), weights=corr.reshape(-1), minlength=mark_size * mark_size)
+    return soft.reshape(mark_size, mark_size)
+
+def embed_watermark_dct(carrier_path, watermark_path, output_path, key=0, strength=6.0, mark_size=32):
+
+    carrier = np.asarray(Image.open(carrier_path).convert("RGB"), dtype=np.float32)
+    if carrier.shape[0] < DCT_BLOCK * mark_size or carrier.shape[1] < DCT_BLOCK * mark_size:
+        raise ValueError(f"载体图片太小，DCT 模式至少需要 {DCT_BLOCK * mark_size}×{DCT_BLOCK * mark_size} 像素")
+    pattern, mask = _dct_key(key, mark_size)
+    bits = _mark_bits(watermark_path, mark_size) * mask
+
+    # 对亮度分块做 DCT，在中频系数上叠加扩频图样，再逆变换得到亮度改变量
+    y = _luma(carrier)
+    blocks = _blocks(y)
+    coeffs = _DCT @ blocks @ _DCT.T
+    h, w = coeffs.shape[:2]
+    sign = bits.reshape(-1)[_block_bit_index(h, w, mark_size)]
+    coeffs[:, :, _DCT_ROWS, _DCT_COLS] += strength * sign[:, :, None] * pattern
+    delta = _unblocks(_DCT.T @ coeffs @ _DCT - blocks)
+
+    # R、G、B 同时加上亮度改变量，色度保持不变
+    out = carrier
+    out[:delta.shape[0], :delta.shape[1]] += delta[:, :, None]
+    watermarked_img = Image.fromarray(np.clip(np.rint(out), 0, 255).astype(np.uint8), "RGB")
+
+    if not output_path.lower().endswith('.png'):
+        output_path += '.png'
+    watermarked_img.save(output_path)
+    print(f"水印嵌入成功（DCT 模式）! 输出文件: {output_path}")
+    return watermarked_img
+
+def _dct_variants(rgb, flips, offsets):
+    # 依次产出 (翻转方式, 网格偏移, 图像)：先撤销翻转，再裁去偏移量以对齐 8×8 网格
+    for flip in flips:
+        img = rgb
+        if "h" in flip:
+            img = img[:, ::-1]
+        if "v" in flip:
+            img = img[::-1]
+        for dy, dx in offsets:
+            yield flip, (dy, dx), img[dy:, dx:]
+
+def extract_watermark_dct(watermarked_path, output_path, key=0, mark_size=32, flip="", offset=(0, 0), shift=(0, 0),
+                          scale=8):
+
+    # flip、offset、shift 可直接使用 detect_watermark_dct 返回的值
+    rgb = np.asarray(Image.open(watermarked_path).convert("RGB"))
+    _, _, img = next(_dct_variants(rgb, [flip], [offset]))
+    pattern, mask = _dct_key(key, mark_size)
+    # 撤销截取造成的比特块循环平移，再与密钥掩码对齐
+    soft = np.roll(_dct_soft_bits(img, pattern, mark_size), (-shift[0], -shift[1]), axis=(0, 1)) * mask
+    mark = np.where(soft > 0, 255, 0).astype(np.uint8)
+
+    watermark_img = Image.fromarray(mark, "L").resize((mark_size * scale, mark_size * scale), Image.NEAREST)
+    if not output_path.lower().endswith('.png'):
+        output_path += '.png'
+    watermark_img.save(output_path)
+    print(f"水印提取成功（DCT 模式）! 输出文件: {output_path}")
+    return watermark_img
+
+def detect_watermark_dct(image_path, watermark_path, key=0, mark_size=32, threshold=6.0, search=True):
+
+    # 返回最佳匹配的检测统计量 z（无水印时近似服从标准正态分布的最大值）
+    rgb = np.asarray(Image.open(image_path).convert("RGB"))
+    pattern, mask = _dct_key(key, mark_size)
+    expected = _mark_bits(watermark_path, mark_size) * mask
+    n = expected.size
+    expected_f = np.fft.rfft2(expected)
+    flips = ["", "h", "v", "hv"] if search else [""]
+    offset_sets = [[(0, 0)]]
+    if search:
+        offset_sets.append([(dy, dx) for dy in range(DCT_BLOCK) for dx in range(DCT_BLOCK) if dy or dx])
+
+    best = {"z": -np.inf}
+    for offsets in offset_sets:
+        for flip, offset, img in _dct_variants(rgb, flips, offsets):
+            if img.shape[0] < DCT_BLOCK or img.shape[1] < DCT_BLOCK:
+                continue
+            got = np.sign(_dct_soft_bits(img, pattern, mark_size))
+            # 截取会使比特块循环平移，用 FFT 一次求出所有循环平移下的相关
+            corr = np.fft.irfft2(np.conj(expected_f) * np.fft.rfft2(got), s=got.shape)
+            shift = np.unravel_index(np.argmax(corr), corr.shape)
+            z = corr[shift] / np.sqrt(n)
+            if z > best["z"]:
+                best = {"z": float(z), "flip": flip, "offset": offset,
+                        "shift": (int(shift[0]), int(shift[1])), "bit_agreement": float((corr[shift] / n + 1) / 2)}
+        # 对齐网格下已检测到时不再搜索其它偏移
+        if best["z"] >= threshold:
+            break
+    best["detected"] = best["z"] >= threshold
+    return best
+
+# ---------------- 批量模式 ----------------
+# 水印载荷（头信息+数据）只编码一次，通过进程池初始化函数分发给每个工作进程，
+# 之后每个任务只传递文件路径。
+
+CARRIER_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+# 每个输出旁的指纹文件，记录生成时的载荷与编码选项
+FINGERPRINT_SUFFIX = ".wmk"
+
+_batch_payload = None
+_batch_options = None
+
+def _payload_fingerprint(payload):
+    # 载荷内容的摘要（已包含水印数据、压缩方式、每通道位数、格式版本）。
+    # 分带与整图嵌入得到的像素完全相同，因此嵌入方式不计入指纹
+    h = hashlib.sha256()
+    h.update(np.packbits(payload.header).tobytes())
+    h.update(payload.body.tobytes())
+    return h.hexdigest()
+
+def _batch_init(payload, options):
+    global _batch_payload, _batch_options
+    _batch_payload = payload
+    _batch_options = options
+
+def _batch_worker(task):
+    carrier_path, output_path = task
+    start = time.perf_counter()
+    # 先写入临时文件再改名，避免失败时留下半成品被误判为“已是最新”
+    part_path = output_path + ".part"
+    try:
+        if _batch_options["tiled"]:
+            _embed_payload_tiled(carrier_path, _batch_payload, part_path, _batch_options["band_height"])
+        else:
+            _embed_payload(carrier_path, _batch_payload, part_path)
+        # 改名前校验输出文件完整（PNG 各数据块的 CRC 与结束标记）
+        with Image.open(part_path) as written:
+            written.verify()
+        os.replace(part_path, output_path)
+        with open(output_path + FINGERPRINT_SUFFIX, "w", encoding="utf-8") as f:
+            f.write(_batch_options["fingerprint"])
+    except Exception as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return carrier_path, f"{type(e).__name__}: {e}", time.perf_counter() - start
+    return carrier_path, None, time.perf_counter() - start
+
+def _list_carriers(source):
+    # source 为目录（取其中的图片文件）或清单文件（每行一个路径，# 开头为注释）
+    if os.path.isdir(source):
+        names = sorted(os.listdir(source))
+        return [os.path.join(source, n) for n in names if n.lower().endswith(CARRIER_EXTENSIONS)]
+    base = os.path.dirname(os.path.abspath(source))
+    carriers = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                carriers.append(line if os.path.isabs(line) else os.path.join(base, line))
+    return carriers
+
+def _up_to_date(output_path, fingerprint, *sources):
+    # 输出比所有输入都新，且生成时的载荷与选项和本次一致
+    sidecar = output_path + FINGERPRINT_SUFFIX
+    if not os.path.exists(output_path) or not os.path.exists(sidecar):
+        return False
+    with open(sidecar, "r", encoding="utf-8") as f:
+        if f.read().strip() != fingerprint:
+            return False
+    mtime = os.path.getmtime(output_path)
+    return all(os.path.getmtime(p) <= mtime for p in sources)
+
+def batch_embed(source, watermark_path, output_dir, workers=None, tiled=False, band_height=256, force=False,
+                compression=None, lsb_bits=1, legacy=False):
+
+    payload = _build_payload(Image.open(watermark_path).convert("RGB"), compression, lsb_bits, legacy)
+    fingerprint = _payload_fingerprint(payload)
+    options = {"tiled": tiled, "band_height": band_height, "fingerprint": fingerprint}
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = []
+    failed = []
+    skipped = 0
+    seen = set()
+    for carrier_path in _list_carriers(source):
+        name = os.path.splitext(os.path.basename(carrier_path))[0] + ".png"
+        output_path = os.path.join(output_dir, name)
+        error = None
+        if output_path in seen:
+            error = f"输出文件名冲突: {output_path}"
+        elif not os.path.exists(carrier_path):
+            error = "文件不存在"
+        if error is not None:
+            failed.append((carrier_path, error))
+            print(f"失败: {carrier_path}: {error}", file=sys.stderr)
+            continue
+        seen.add(output_path)
+        if not force and _up_to_date(output_path, fingerprint, carrier_path, watermark_path):
+            skipped += 1
+            continue
+        tasks.append((carrier_path, output_path))
+
+    start = time.perf_counter()
+    done = 0
+    in_bytes = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_batch_init,
+                             initargs=(payload, options)) as pool:
+        for carrier_path, error, _ in pool.map(_batch_worker, tasks, chunksize=4):
+            if error is None:
+                done += 1
+                in_bytes += os.path.getsize(carrier_path)
+            else:
+                failed.append((carrier_path, error))
+                print(f"失败: {carrier_path}: {error}", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    rate = done / elapsed if elapsed > 0 else 0.0
+    mb_rate = in_bytes / 1e6 / elapsed if elapsed > 0 else 0.0
+    print(f"批量嵌入完成: 成功 {done} 张, 跳过 {skipped} 张（已是最新）, 失败 {len(failed)} 张")
+    print(f"耗时 {elapsed:.2f} 秒, 吞吐 {rate:.1f} 张/秒, {mb_rate:.1f} MB/秒")
+    return {"done": done, "skipped": skipped, "failed": failed, "seconds": elapsed}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="图片 LSB 水印批量嵌入")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("batch", help="对目录或清单中的所有载体图片嵌入同一水印")
+    p.add_argument("source", help="载体图片目录，或每行一个路径的清单文件")
+    p.add_argument("watermark", help="水印图片")
+    p.add_argument("output_dir", help="输出目录")
+    p.add_argument("-j", "--workers", type=int, default=None, help="工作进程数，默认为 CPU 核数")
+    p.add_argument("--tiled", action="store_true", help="使用分带流式模式（适合超大图片）")
+    p.add_argument("--band-height", type=int, default=256)
+    p.add_argument("--force", action="store_true", help="即使输出已是最新也重新处理")
+    p.add_argument("--compression", choices=sorted(COMPRESSION_METHODS), default=None,
+                   help="压缩方式，默认第2版为 zlib，旧格式不压缩")
+    p.add_argument("--lsb-bits", type=int, choices=[1, 2, 3, 4], default=1, help="每个颜色通道嵌入的位数")
+    p.add_argument("--legacy", action="store_true", help="使用第1版格式（未压缩，每通道1位）")
+    args = parser.parse_args(argv)
+
+    result = batch_embed(args.source, args.watermark, args.output_dir, workers=args.workers,
+                         tiled=args.tiled, band_height=args.band_height, force=args.force,
+                         compression=args.compression, lsb_bits=args.lsb_bits, legacy=args.legacy)
+    return 1 if result["failed"] else 0
+
 if __name__ == "__main__":
 
+    if len(sys.argv) > 1:
+        sys.exit(main())
+
     carrier_image = "example1.png"
     watermark_image = "example2.png"
     watermarked_image = "example_im.png"
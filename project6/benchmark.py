@@ -0,0 +1,139 @@
+import argparse
+import itertools
+import json
+import platform
+import random
+import statistics
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from project6 import (
+    HashToGroupCache,
+    P1Input,
+    P1Session,
+    P2Input,
+    ProtocolTracer,
+    ddh_pis_protocol,
+)
+
+# 输出中的阶段 -> ddh_pis_protocol 追踪器中对应的阶段
+PHASES = {
+    "keygen": ["keygen"],
+    "hashing": ["round1_hash", "round2_hash"],
+    "blinding": ["round1_blind", "round2_blind", "round3_blind"],
+    "paillier_encrypt": ["round2_encrypt"],
+    "matching": ["round3_match"],
+    "homomorphic_sum": ["round3_sum"],
+    "decrypt": ["decrypt"],
+}
+
+# 生成测试集合：交集大小 = ratio * min(|V|, |W|)
+def make_sets(v_size: int, w_size: int, ratio: float, rng: random.Random) -> Tuple[P1Input, P2Input, int]:
+    if not 0.0 <= ratio <= 1.0:
+        raise ValueError(f"交集比例必须在 [0, 1] 之间: {ratio}")
+    common = int(round(ratio * min(v_size, w_size)))
+    shared = [f"shared-{i}" for i in range(common)]
+    V = shared + [f"p1-{i}" for i in range(v_size - common)]
+    W_ids = shared + [f"p2-{i}" for i in range(w_size - common)]
+    rng.shuffle(V)
+    rng.shuffle(W_ids)
+    W = [(w, rng.randrange(1, 1000)) for w in W_ids]
+    expected = sum(t for (w, t) in W if w.startswith("shared-"))
+    return P1Input(V=V), P2Input(W=W), expected
+
+# 运行一次 ddh_pis_protocol，由 ProtocolTracer 给出各阶段耗时与各方发送的字节数
+def run_once(P1: P1Input, P2: P2Input, paillier_bits: int,
+             cache: Optional[HashToGroupCache] = None,
+             session: Optional[P1Session] = None) -> Dict:
+    tracer = ProtocolTracer()
+    result = ddh_pis_protocol(P1, P2, paillier_bits=paillier_bits, verbose=False,
+                              session=session, cache=cache, tracer=tracer)
+    trace = result["trace"]
+    durations = trace["durations"]
+    phases = {ph: sum(durations.get(name, 0.0) for name in names) for ph, names in PHASES.items()}
+    return {
+        "phases": phases,
+        "total": trace["total_seconds"],
+        "bytes_sent": trace["bytes_sent"],
+        "pow_counts": trace["pow_counts"],
+        "J_size": result["J_size"],
+        "decrypted_sum": result["decrypted_sum"],
+    }
+
+def bench_config(v_size: int, w_size: int, ratio: float, paillier_bits: int,
+                 repeat: int, seed: int, use_cache: bool = False, incremental: bool = False) -> Dict:
+    rng = random.Random(seed)
+    P1, P2, expected = make_sets(v_size, w_size, ratio, rng)
+    random.seed(seed)
+    # 启用缓存/增量会话时在多次重复之间共享，第一次之后的运行即体现其收益
+    cache = HashToGroupCache() if use_cache else None
+    session = P1Session.new(cache=cache) if incremental else None
+    runs = [run_once(P1, P2, paillier_bits, cache, session) for _ in range(repeat)]
+    for r in runs:
+        if r["decrypted_sum"] != expected:
+            raise RuntimeError(f"解密结果 {r['decrypted_sum']} 与期望 {expected} 不一致")
+    phases = {ph: {"min": min(r["phases"][ph] for r in runs),
+                   "median": statistics.median(r["phases"][ph] for r in runs)}
+              for ph in PHASES}
+    bytes_sent = runs[0]["bytes_sent"]
+    return {
+        "V_size": v_size,
+        "W_size": w_size,
+        "intersection_ratio": ratio,
+        "paillier_bits": paillier_bits,
+        "cache": use_cache,
+        "incremental": incremental,
+        "J_size": runs[0]["J_size"],
+        "repeat": repeat,
+        "seconds": phases,
+        "total_seconds": {"min": min(r["total"] for r in runs),
+                          "median": statistics.median(r["total"] for r in runs)},
+        "pow_counts": [r["pow_counts"] for r in runs],
+        "bytes_sent": bytes_sent,
+        "total_bytes": sum(sum(v.values()) for v in bytes_sent.values()),
+    }
+
+def _int_list(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x]
+
+def _float_list(s: str) -> List[float]:
+    return [float(x) for x in s.split(",") if x]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="DDH-PSI-Sum 协议扩展性基准测试")
+    ap.add_argument("--v-sizes", type=_int_list, default=[16, 64, 256])
+    ap.add_argument("--w-sizes", type=_int_list, default=[16, 64, 256])
+    ap.add_argument("--ratios", type=_float_list, default=[0.1, 0.5])
+    ap.add_argument("--paillier-bits", type=_int_list, default=[512, 1024])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--cache", action="store_true", help="在重复运行之间共享 hash_to_group 缓存")
+    ap.add_argument("--incremental", action="store_true", help="在重复运行之间复用 P1 增量会话")
+    ap.add_argument("--output", "-o", default="-", help="结果 JSON 文件路径，默认输出到标准输出")
+    args = ap.parse_args(argv)
+
+    results = []
+    for v, w, r, bits in itertools.product(args.v_sizes, args.w_sizes, args.ratios, args.paillier_bits):
+        res = bench_config(v, w, r, bits, args.repeat, args.seed, args.cache, args.incremental)
+        print(f"|V|={v} |W|={w} ratio={r} bits={bits}: {res['total_seconds']['median']:.3f}s, "
+              f"{res['total_bytes']} 字节", file=sys.stderr)
+        results.append(res)
+
+    report = {
+        "benchmark": "ddh_pis_protocol",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "cache": args.cache,
+        "incremental": args.incremental,
+        "results": results,
+    }
+    out = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(out)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(out + "\n")
+
+if __name__ == "__main__":
+    main()
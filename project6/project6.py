@@ -1,8 +1,14 @@
 import random
 import hashlib
 import math
-from dataclasses import dataclass
-from typing import List, Tuple
+import json
+import os
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
 
 # 参数
 RFC3526_MODP_2048_P = int(
@@ -23,12 +29,66 @@ RFC3526_MODP_2048_Q = (RFC3526_MODP_2048_P - 1) // 2  #安全素数 q
 def sha256_int(data: bytes) -> int:
     return int.from_bytes(hashlib.sha256(data).digest(), "big")
 
-def hash_to_group(u: str) -> int:
+def _hash_to_group(u: str) -> int:
     x = sha256_int(u.encode("utf-8")) % RFC3526_MODP_2048_Q
     if x == 0:
         x = 1
     return pow(RFC3526_MODP_2048_G, x, RFC3526_MODP_2048_P)
 
+# hash_to_group 结果缓存（LRU 淘汰，可持久化到 JSON 文件）
+class HashToGroupCache:
+    def __init__(self, maxsize: int = 1 << 20, path: Optional[str] = None):
+        if maxsize <= 0:
+            raise ValueError("maxsize 必须为正数")
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, int]" = OrderedDict()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, u: str) -> bool:
+        return u in self._data
+
+    def get(self, u: str) -> int:
+        h = self._data.get(u)
+        if h is not None:
+            self._data.move_to_end(u)
+            self.hits += 1
+            return h
+        self.misses += 1
+        h = _hash_to_group(u)
+        self._data[u] = h
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return h
+
+    def load(self, path: str) -> None:
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+        # 文件中按最近使用顺序保存，超出容量时只保留最近的部分
+        for u, hx in items[-self.maxsize:]:
+            self._data[u] = int(hx, 16)
+            self._data.move_to_end(u)
+
+    def save(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        if path is None:
+            raise ValueError("未指定缓存文件路径")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump([[u, format(h, "x")] for u, h in self._data.items()], f)
+        os.replace(tmp, path)
+
+def hash_to_group(u: str, cache: Optional[HashToGroupCache] = None) -> int:
+    if cache is None:
+        return _hash_to_group(u)
+    return cache.get(u)
+
 # 简单 Paillier 实现
 def _is_probable_prime(n: int, k: int = 16) -> bool:
     if n < 2:
@@ -126,68 +186,284 @@ class P1Input:
 class P2Input:
     W: List[Tuple[str, int]]  
 
-def ddh_pis_protocol(P1: P1Input, P2: P2Input, paillier_bits: int = 512, verbose: bool = True):
+# 协议插桩接口：默认使用 NullTracer，所有方法均为空操作；
+# 协议只在阶段边界按批次上报（而不是在每次 pow 时调用），因此关闭时几乎没有开销。
+# pow 计数只统计协议各轮中的模幂运算（哈希以实际使用缓存的未命中数计），
+# 不含 Paillier 密钥生成内部（素性检测、求 mu）的模幂运算。
+class NullTracer:
+    enabled = False
+
+    @contextmanager
+    def phase(self, name: str):
+        yield
+
+    def count_pow(self, modulus_bits: int, n: int = 1) -> None:
+        pass
+
+    def count_paillier(self, op: str, n: int = 1) -> None:
+        pass
+
+    def record_size(self, name: str, n: int) -> None:
+        pass
+
+    def count_bytes(self, sender: str, message: str, n: int) -> None:
+        pass
+
+class ProtocolTracer(NullTracer):
+    enabled = True
+
+    def __init__(self, track_memory: bool = False,
+                 on_phase: Optional[Callable[[str, float], None]] = None):
+        self.track_memory = track_memory
+        self.on_phase = on_phase
+        self.durations: Dict[str, float] = {}
+        self.memory_peaks: Dict[str, int] = {}
+        self.pow_counts: Dict[int, int] = {}
+        self.paillier_counts: Dict[str, int] = {}
+        self.peak_sizes: Dict[str, int] = {}
+        self.bytes_sent: Dict[str, Dict[str, int]] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = False
+        if self.track_memory:
+            # 仅在本阶段内开启 tracemalloc，若由本追踪器开启则在阶段结束时关闭；
+            # 若调用方已在追踪，则不重置其峰值，只记录阶段开始时的基线
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            base, base_peak = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+            if self.track_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                # 全局峰值未在本阶段内刷新时，阶段峰值无法得知，以阶段结束时的增量作为下界
+                peak = peak - base if peak > base_peak else max(current - base, 0)
+                self.memory_peaks[name] = max(self.memory_peaks.get(name, 0), peak)
+                if started:
+                    tracemalloc.stop()
+            if self.on_phase is not None:
+                self.on_phase(name, elapsed)
+
+    def count_pow(self, modulus_bits: int, n: int = 1) -> None:
+        self.pow_counts[modulus_bits] = self.pow_counts.get(modulus_bits, 0) + n
+
+    def count_paillier(self, op: str, n: int = 1) -> None:
+        self.paillier_counts[op] = self.paillier_counts.get(op, 0) + n
+
+    def record_size(self, name: str, n: int) -> None:
+        if n > self.peak_sizes.get(name, 0):
+            self.peak_sizes[name] = n
+
+    def count_bytes(self, sender: str, message: str, n: int) -> None:
+        msgs = self.bytes_sent.setdefault(sender, {})
+        msgs[message] = msgs.get(message, 0) + n
+
+    def summary(self) -> Dict:
+        return {
+            "durations": dict(self.durations),
+            "total_seconds": sum(self.durations.values()),
+            "pow_counts": {str(bits): c for bits, c in sorted(self.pow_counts.items())},
+            "paillier_counts": dict(self.paillier_counts),
+            "peak_sizes": dict(self.peak_sizes),
+            "memory_peaks": dict(self.memory_peaks),
+            "bytes_sent": {k: dict(v) for k, v in self.bytes_sent.items()},
+        }
+
+_NULL_TRACER = NullTracer()
+
+# P1 增量会话：保留私钥 k1 以及上一次运行得到的 H(v)^k1，
+# 再次运行时只对新增元素做盲化，删除的元素直接丢弃，开销与变化量成正比。
+# 注意：k1 跨运行复用意味着 P2 能够关联不同批次中相同的盲化值（即得知集合的变化量）。
+@dataclass
+class P1Session:
+    k1: int
+    blinded: Dict[str, int] = field(default_factory=dict)
+    cache: Optional[HashToGroupCache] = None
+    last_added: int = 0
+    last_removed: int = 0
+
+    @classmethod
+    def new(cls, cache: Optional[HashToGroupCache] = None) -> "P1Session":
+        return cls(k1=random.randrange(1, RFC3526_MODP_2048_Q), cache=cache)
+
+    def blind(self, V: List[str], cache: Optional[HashToGroupCache] = None) -> List[int]:
+        # cache 为 None 时使用会话自带的缓存
+        p = RFC3526_MODP_2048_P
+        if cache is None:
+            cache = self.cache
+        current = set(V)
+        removed = [v for v in self.blinded if v not in current]
+        for v in removed:
+            del self.blinded[v]
+        added = 0
+        for v in current:
+            if v not in self.blinded:
+                self.blinded[v] = pow(hash_to_group(v, cache), self.k1, p)
+                added += 1
+        self.last_added = added
+        self.last_removed = len(removed)
+        return [self.blinded[v] for v in V]
+
+    def save(self, path: str) -> None:
+        state = {
+            "k1": format(self.k1, "x"),
+            "blinded": {v: format(x, "x") for v, x in self.blinded.items()},
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+        if self.cache is not None and self.cache.path is not None:
+            self.cache.save()
+
+    @classmethod
+    def load(cls, path: str, cache: Optional[HashToGroupCache] = None) -> "P1Session":
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        blinded = {v: int(x, 16) for v, x in state["blinded"].items()}
+        return cls(k1=int(state["k1"], 16), blinded=blinded, cache=cache)
+
+def ddh_pis_protocol(P1: P1Input, P2: P2Input, paillier_bits: int = 512, verbose: bool = True,
+                     session: Optional[P1Session] = None,
+                     cache: Optional[HashToGroupCache] = None,
+                     tracer: Optional[NullTracer] = None):
 
     p = RFC3526_MODP_2048_P
     q = RFC3526_MODP_2048_Q
     g = RFC3526_MODP_2048_G
+    tr = tracer if tracer is not None else _NULL_TRACER
+    p_bits = p.bit_length()
+    group_bytes = (p_bits + 7) // 8  # 群元素按定长大端序列化
 
-    k1 = random.randrange(1, q)
+    if session is not None:
+        k1 = session.k1
+        # 显式传入的 cache 优先于会话自带的缓存，P1 与 P2 的哈希都使用同一个缓存
+        if cache is None:
+            cache = session.cache
+    else:
+        k1 = random.randrange(1, q)
     k2 = random.randrange(1, q)
     if verbose:
         print("初始化（Setup）")
         print("P1 随机选取私钥 k1，P2 随机选取私钥 k2（保密）")
         print("P2 生成 Paillier 密钥对并把公钥发送给 P1")
 
-    pk, sk = paillier_keygen(bits=paillier_bits)
+    with tr.phase("keygen"):
+        pk, sk = paillier_keygen(bits=paillier_bits)
+    n2_bits = pk.n2.bit_length()
+    ct_bytes = (n2_bits + 7) // 8
+    if tr.enabled:
+        tr.count_paillier("keygen")
+        tr.count_bytes("P2", "setup_pk", (pk.n.bit_length() + 7) // 8)
     if verbose:
         print(f"已生成 Paillier 密钥（公钥模 n 的位长约 {pk.n.bit_length()} 位）")
         print()
 
-    R1 = [pow(hash_to_group(vi), k1, p) for vi in P1.V]
+    misses = cache.misses if cache is not None else 0
+    if session is not None:
+        # 增量模式下只对新增元素做哈希与盲化，两者一并计入 round1_blind
+        with tr.phase("round1_blind"):
+            R1 = session.blind(P1.V, cache)
+    elif tr.enabled:
+        # 追踪时把哈希与盲化拆成两遍以分别计时
+        with tr.phase("round1_hash"):
+            H_V = [hash_to_group(vi, cache) for vi in P1.V]
+        with tr.phase("round1_blind"):
+            R1 = [pow(h, k1, p) for h in H_V]
+    else:
+        # 未追踪时单遍完成，不保留中间列表
+        R1 = [pow(hash_to_group(vi, cache), k1, p) for vi in P1.V]
     random.shuffle(R1)  # 打乱顺序以防位置关联
+    if tr.enabled:
+        blinded = session.last_added if session is not None else len(P1.V)
+        hashed = cache.misses - misses if cache is not None else blinded
+        tr.count_pow(p_bits, hashed + blinded)
+        tr.record_size("R1", len(R1))
+        tr.count_bytes("P1", "round1_R1", len(R1) * group_bytes)
     if verbose:
         print("第 1 轮")
         print(f"P1 对 V 中 {len(P1.V)} 个元素计算 H(v)^{k1} 并打乱后发送给 P2。")
+        if session is not None:
+            print(f"（增量模式：新增 {session.last_added} 个，删除 {session.last_removed} 个，其余复用上次结果）")
         print()
 
-    Z = [pow(x, k2, p) for x in R1]
+    misses = cache.misses if cache is not None else 0
+    with tr.phase("round2_blind"):
+        Z = [pow(x, k2, p) for x in R1]
     random.shuffle(Z)
-    pairs = []
-    for (wj, tj) in P2.W:
-        h_w_k2 = pow(hash_to_group(wj), k2, p)
-        enc_tj = paillier_enc(pk, tj)
-        pairs.append((h_w_k2, enc_tj))
+    if tr.enabled:
+        with tr.phase("round2_hash"):
+            H_W = [hash_to_group(wj, cache) for (wj, _) in P2.W]
+        with tr.phase("round2_blind"):
+            H_W_k2 = [pow(h, k2, p) for h in H_W]
+        with tr.phase("round2_encrypt"):
+            enc_T = [paillier_enc(pk, tj) for (_, tj) in P2.W]
+        pairs = list(zip(H_W_k2, enc_T))
+    else:
+        pairs = [(pow(hash_to_group(wj, cache), k2, p), paillier_enc(pk, tj)) for (wj, tj) in P2.W]
     random.shuffle(pairs)
+    if tr.enabled:
+        hashed = cache.misses - misses if cache is not None else len(P2.W)
+        tr.count_pow(p_bits, len(R1) + hashed + len(P2.W))
+        tr.count_pow(n2_bits, 2 * len(P2.W))  # 每次加密两次模 n^2 幂运算
+        tr.count_paillier("enc", len(P2.W))
+        tr.record_size("Z", len(Z))
+        tr.record_size("pairs", len(pairs))
+        tr.count_bytes("P2", "round2_Z", len(Z) * group_bytes)
+        tr.count_bytes("P2", "round2_pairs", len(pairs) * (group_bytes + ct_bytes))
     if verbose:
         print("第 2 轮")
         print(f"P2 对收到的 R1 中每项再做 ^k2，得到 Z 并发送给 P1。")
         print(f"P2 还发送其自身 W 转换后的配对 (H(w)^{k2}, Enc(t)) 共 {len(pairs)} 项，顺序也已打乱。")
         print()
 
-    pairs_k1 = [(pow(hk2, k1, p), ct) for (hk2, ct) in pairs]  
-    Zset = set(Z)
-    J_indices = [i for i, (h12, ct) in enumerate(pairs_k1) if h12 in Zset]
+    with tr.phase("round3_blind"):
+        pairs_k1 = [(pow(hk2, k1, p), ct) for (hk2, ct) in pairs]
+    with tr.phase("round3_match"):
+        Zset = set(Z)
+        J_indices = [i for i, (h12, ct) in enumerate(pairs_k1) if h12 in Zset]
+    if tr.enabled:
+        tr.count_pow(p_bits, len(pairs))
+        tr.record_size("J", len(J_indices))
     if verbose:
         print("第 3 轮")
         print("P1 将接收到的 pairs 中的第一分量再做 ^k1，变为 H(w)^{k1 k2}，并与 Z 比较匹配。")
         print(f"P1 识别出交集中的元素数量（|J|） = {len(J_indices)}")
         print()
 
-    if not J_indices:
-        C_sum = paillier_enc(pk, 0)  
-    else:
-        C_sum = pairs_k1[J_indices[0]][1]
-        for idx in J_indices[1:]:
-            C_sum = paillier_add(pk, C_sum, pairs_k1[idx][1])
+    with tr.phase("round3_sum"):
+        if not J_indices:
+            C_sum = paillier_enc(pk, 0)
+        else:
+            C_sum = pairs_k1[J_indices[0]][1]
+            for idx in J_indices[1:]:
+                C_sum = paillier_add(pk, C_sum, pairs_k1[idx][1])
 
-    C_rand = paillier_rerandomize(pk, C_sum)
+        C_rand = paillier_rerandomize(pk, C_sum)
+    if tr.enabled:
+        if not J_indices:
+            tr.count_paillier("enc")
+            tr.count_pow(n2_bits, 2)
+        else:
+            tr.count_paillier("add", len(J_indices) - 1)
+        tr.count_paillier("rerandomize")
+        tr.count_pow(n2_bits)
+        tr.count_bytes("P1", "round3_sum", ct_bytes)
     if verbose:
         print("P1 对同态求和结果进行重随机化后发送给 P2。")
         print()
 
     # P2 用私钥解密得到交集求和结果
-    sum_value = paillier_dec(sk, C_rand)
+    with tr.phase("decrypt"):
+        sum_value = paillier_dec(sk, C_rand)
+    if tr.enabled:
+        tr.count_paillier("dec")
+        tr.count_pow(n2_bits)
     if verbose:
         print("输出")
         print(f"P2 解密得到交集元素对应 t 值之和 = {sum_value}")
@@ -207,13 +483,16 @@ def ddh_pis_protocol(P1: P1Input, P2: P2Input, paillier_bits: int = 512, verbose
             print(" 解密结果与期望一致。")
         else:
             print(" 解密结果与期望不一致。")
-    return {
+    result = {
         "decrypted_sum": sum_value,
         "expected_sum": expected,
         "intersection_items": intersected,
         "J_size": len(J_indices),
         "paillier_n_bits": pk.n.bit_length()
     }
+    if tr.enabled:
+        result["trace"] = tr.summary()
+    return result
 
 def main_demo():
     random.seed(42)
@@ -0,0 +1,114 @@
+import os
+import random
+import sys
+import tracemalloc
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import project6 as p6
+
+BITS = 256
+
+def test_cache_lru_eviction():
+    cache = p6.HashToGroupCache(maxsize=2)
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")  # a 变为最近使用，下一次淘汰 b
+    cache.get("c")
+    assert len(cache) == 2
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert cache.get("a") == p6._hash_to_group("a")
+
+def test_cache_rejects_nonpositive_maxsize():
+    with pytest.raises(ValueError):
+        p6.HashToGroupCache(maxsize=0)
+
+def test_cache_save_load_round_trip(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = p6.HashToGroupCache(path=path)
+    for u in ["a", "b", "c", "d"]:
+        cache.get(u)
+    cache.get("a")
+    cache.save()
+
+    loaded = p6.HashToGroupCache(path=path)
+    assert len(loaded) == 4
+    for u in ["a", "b", "c", "d"]:
+        assert loaded.get(u) == p6._hash_to_group(u)
+    assert loaded.misses == 0
+
+    # 文件比容量大时只保留最近使用的部分（b 最久未用，其次 c）
+    small = p6.HashToGroupCache(maxsize=2, path=path)
+    assert len(small) == 2
+    assert "d" in small and "a" in small
+    assert "b" not in small and "c" not in small
+
+def _run(V, W, session):
+    return p6.ddh_pis_protocol(p6.P1Input(V=V), p6.P2Input(W=W), paillier_bits=BITS,
+                               verbose=False, session=session)
+
+def test_session_incremental_runs(tmp_path):
+    random.seed(0)
+    W = [("a", 1), ("b", 2), ("c", 4), ("x", 8), ("y", 16)]
+    cache = p6.HashToGroupCache()
+    session = p6.P1Session.new(cache=cache)
+
+    result = _run(["a", "b", "q"], W, session)
+    assert result["decrypted_sum"] == result["expected_sum"] == 3
+    assert (session.last_added, session.last_removed) == (3, 0)
+
+    # 新增 2 个、删除 1 个
+    result = _run(["a", "q", "x", "y"], W, session)
+    assert result["decrypted_sum"] == result["expected_sum"] == 25
+    assert (session.last_added, session.last_removed) == (2, 1)
+    assert set(session.blinded) == {"a", "q", "x", "y"}
+
+    path = str(tmp_path / "session.json")
+    session.save(path)
+    reloaded = p6.P1Session.load(path, cache=cache)
+    assert reloaded.k1 == session.k1
+    assert reloaded.blinded == session.blinded
+
+    result = _run(["a", "c", "q", "x", "y"], W, reloaded)
+    assert result["decrypted_sum"] == result["expected_sum"] == 29
+    assert (reloaded.last_added, reloaded.last_removed) == (1, 0)
+    assert reloaded.blinded["c"] == pow(p6._hash_to_group("c"), session.k1, p6.RFC3526_MODP_2048_P)
+
+def test_tracer_keeps_caller_tracemalloc_peak():
+    tracemalloc.start()
+    try:
+        big = bytearray(4 << 20)
+        del big
+        caller_peak = tracemalloc.get_traced_memory()[1]
+        tracer = p6.ProtocolTracer(track_memory=True)
+        with tracer.phase("small"):
+            small = bytearray(1 << 16)
+            del small
+        assert tracemalloc.is_tracing()
+        assert tracemalloc.get_traced_memory()[1] >= caller_peak
+        assert tracer.memory_peaks["small"] < caller_peak
+    finally:
+        tracemalloc.stop()
+
+def test_tracer_stops_tracemalloc_it_started():
+    tracer = p6.ProtocolTracer(track_memory=True)
+    with tracer.phase("alloc"):
+        data = bytearray(1 << 20)
+        del data
+    assert not tracemalloc.is_tracing()
+    assert tracer.memory_peaks["alloc"] >= 1 << 20
+
+@pytest.mark.parametrize("traced", [False, True])
+def test_protocol_sum(traced):
+    random.seed(1)
+    V = ["a", "b", "c", "d"]
+    W = [("b", 5), ("e", 7), ("c", 11)]
+    tracer = p6.ProtocolTracer() if traced else None
+    result = p6.ddh_pis_protocol(p6.P1Input(V=V), p6.P2Input(W=W), paillier_bits=BITS,
+                                 verbose=False, tracer=tracer)
+    assert result["decrypted_sum"] == result["expected_sum"] == 16
+    assert result["J_size"] == 2
+    assert ("trace" in result) == traced